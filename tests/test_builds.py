@@ -1,4 +1,5 @@
 import contextlib
+import json
 import os
 import shutil
 import tempfile
@@ -127,3 +128,22 @@ async def test_tree():
             tplbld,
         )
         assert result == 0
+
+
+@pytest.mark.io
+async def test_save_build_data_salt():
+    """Test that saved build data always carries a stable hash salt."""
+    async with setup_build_test("tree") as (base_dir, tplbld):
+        build_data_path = os.path.join(base_dir, ".tplbuilddata.json")
+        tplbld.save_build_data()
+        with open(build_data_path, encoding="utf-8") as fdata:
+            salt = json.load(fdata)["hash_salt"]
+        assert salt
+
+        async with TplBuild.from_path(
+            base_dir, user_config=UserConfig(client_type=TEST_CLIENT_TYPE)
+        ) as tplbld_reloaded:
+            assert tplbld_reloaded.build_data.get_hash_salt() == salt
+            tplbld_reloaded.save_build_data()
+        with open(build_data_path, encoding="utf-8") as fdata:
+            assert json.load(fdata)["hash_salt"] == salt
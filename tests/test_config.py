@@ -0,0 +1,15 @@
+import pydantic
+import pytest
+
+from tplbuild.config import TplContextConfig
+
+
+@pytest.mark.unit
+def test_context_umask():
+    """Test umask validation on context configs"""
+    for umask in ("000", "022", "077", "0777", "777", None):
+        assert TplContextConfig(umask=umask).umask == umask
+
+    for umask in ("1000", "-1", "8", "7a", "abc", ""):
+        with pytest.raises(pydantic.ValidationError):
+            TplContextConfig(umask=umask)
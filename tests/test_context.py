@@ -4,11 +4,18 @@ import os
 import re
 import tarfile
 import tempfile
+import time
 from typing import Optional
 
 import pytest
 
-from tplbuild.context import BuildContext, _create_pattern, _create_pattern_part
+from tplbuild.context import (
+    BuildContext,
+    ContextPattern,
+    _create_pattern,
+    _create_pattern_part,
+    _hash_file,
+)
 
 
 @contextlib.contextmanager
@@ -69,6 +76,7 @@ def test_create_pattern_part():
         "_[ab-yz]?.*": (f"/_[ab-yz]{no_sep}?\\.{no_sep}*", False),
         ".{ }^|": (r"/\.\{\ \}\^\|", True),
         "a[[]b]c": (r"/a[\[]b\]c", False),
+        "[.-z]": (r"/[\.-z]", False),
     }
     value_error_tests = {
         "[hi": "Unclosed character class",
@@ -78,6 +86,7 @@ def test_create_pattern_part():
         "[^-c]": "Unexpected '-' in character class",
         "[a-b-c]": "Unexpected '-' in character class",
         "[b-a]": "Invalid character range",
+        "[z-.]": "Invalid character range",
         "[]": "Empty character class",
         "[^]": "Empty character class",
         "[a-]": "Unclosed character range",
@@ -138,6 +147,134 @@ def test_create_pattern():
     pytest.raises(ValueError, _create_pattern, "a/[/]", True)
 
 
+@pytest.mark.unit
+def test_ignored():
+    """Test that the last matching ignore pattern decides if a path is ignored"""
+    ctx = BuildContext(
+        None,
+        None,
+        ["# comment", "  ", "**/*.c", "!a/b", "a/b/*.c", "!a/b/keep.c", "x"],
+    )
+    pass_tests = {
+        "/main.c": True,
+        "/main.h": False,
+        "/a": False,
+        "/a/main.c": True,
+        "/a/b": False,
+        "/a/b/main.c": True,
+        "/a/b/main.h": False,
+        "/a/b/keep.c": False,
+        "/a/b/keep.c/sub": False,
+        "/x": True,
+        "/x/y": True,
+        "/y/x": False,
+    }
+    for path, expected in pass_tests.items():
+        assert ctx.ignored(path.replace("/", os.path.sep)) == expected, path
+
+    assert not BuildContext(None, None, []).ignored(os.path.sep + "a")
+
+
+@pytest.mark.unit
+def test_subtree_pattern():
+    """Test that subtree patterns match directories a pattern could reach into"""
+    pass_tests = {
+        ("a/b/*.c", "/a"): True,
+        ("a/b/*.c", "/a/b"): True,
+        ("a/b/*.c", "/a/b/x.c"): True,
+        ("a/b/*.c", "/b"): False,
+        ("a/b/*.c", "/a/c"): False,
+        ("!a/b", "/a/b/c"): True,
+        ("**/*.c", "/x/y/z"): True,
+        ("x", "/y"): False,
+        ("b[^a]/**", "/b"): True,
+        ("a/b[!-0]", "/a/b"): True,
+        ("a/b[!-0]", "/c"): False,
+    }
+    for (pattern, path), expected in pass_tests.items():
+        subtree_pattern = ContextPattern(pattern).subtree_pattern
+        matched = subtree_pattern.match(path.replace("/", os.path.sep)) is not None
+        assert matched == expected, (pattern, path)
+
+
+@pytest.mark.io
+def test_walk_context_matches_ignored():
+    """Test that walking the context agrees with ignored() for each path"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_test(
+            tmpdir,
+            0o755,
+            {
+                "b": (0o755, {"a": (0o755, {"h": (0o644, b"h\n")})}),
+                "bc": (0o755, {"d": (0o644, b"d\n")}),
+                "c": (0o644, b"c\n"),
+            },
+        )
+        ctx = BuildContext(tmpdir, None, ["b[^a]/**"])
+        assert ctx.ignored(os.path.join(os.path.sep, "b", "a"))
+        assert ctx.ignored(os.path.join(os.path.sep, "b", "a", "h"))
+
+        expected = ["/"]
+        for root, dirs, files in os.walk(tmpdir):
+            for name in dirs + files:
+                path = os.path.sep + os.path.relpath(os.path.join(root, name), tmpdir)
+                if not ctx.ignored(path):
+                    expected.append(path.replace(os.path.sep, "/"))
+        assert sorted(tarinfo.name for tarinfo in ctx.walk_context()) == sorted(
+            expected
+        )
+
+
+@pytest.mark.io
+def test_hash_file():
+    """Test that file hashes are cached by file identity and track changes"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data")
+        with open(path, "wb") as fdata:
+            fdata.write(b"hello")
+        hsh = _hash_file(path)
+        assert _hash_file(path) == hsh
+        assert _hash_file(os.path.join(tmpdir, ".", "data")) == hsh
+
+        with open(path, "wb") as fdata:
+            fdata.write(b"goodbye")
+        assert _hash_file(path) != hsh
+
+
+@pytest.mark.io
+def test_hash_file_same_stat():
+    """Test that files with matching stat results are hashed separately"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path_a = os.path.join(tmpdir, "a")
+        path_b = os.path.join(tmpdir, "b")
+        for path, data in ((path_a, b"aaaa"), (path_b, b"bbbb")):
+            with open(path, "wb") as fdata:
+                fdata.write(data)
+            os.utime(path, ns=(0, 10**9))
+
+        # Mimic platforms that report zero for st_dev and st_ino.
+        def zero_ids(path):
+            statres = os.stat(path)
+            return os.stat_result(
+                (statres.st_mode, 0, 0, 1, 0, 0, statres.st_size, 0, 1, 0),
+                {"st_mtime_ns": statres.st_mtime_ns},
+            )
+
+        assert _hash_file(path_a, zero_ids(path_a)) != _hash_file(
+            path_b, zero_ids(path_b)
+        )
+
+        # Recently modified files may change without changing their stat
+        # results on coarse file systems so must not be served from cache.
+        mtime_ns = time.time_ns()
+        os.utime(path_a, ns=(mtime_ns, mtime_ns))
+        hsh = _hash_file(path_a)
+        with open(path_a, "wb") as fdata:
+            fdata.write(b"cccc")
+        os.utime(path_a, ns=(mtime_ns, mtime_ns))
+        assert _hash_file(path_a) != hsh
+
+
 @pytest.mark.io
 @set_umask(0)
 def test_write_context():
@@ -283,6 +420,32 @@ def test_write_context():
             assert ti.mode == 0o755
 
 
+@pytest.mark.io
+def test_write_context_fd():
+    """Test writing a context to a file descriptor matches the tarfile output"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_test(
+            tmpdir,
+            0o755,
+            {
+                "empty": (0o644, b""),
+                "small": (0o644, b"small\n"),
+                "large": (0o644, os.urandom(3 * 2**16 + 7)),
+                "subdir": (0o755, {"block": (0o600, b"x" * 512)}),
+            },
+        )
+        ctx = BuildContext(tmpdir, 0o022, [])
+        extra_files = {"./abc": (0o642, b"abcdata")}
+
+        iob = io.BytesIO()
+        ctx.write_context(iob, extra_files=extra_files)
+
+        with tempfile.TemporaryFile() as fout:
+            ctx.write_context(fout, extra_files=extra_files)
+            fout.seek(0)
+            assert fout.read() == iob.getvalue()
+
+
 @pytest.mark.io
 def test_null_context():
     """Test using a null context"""
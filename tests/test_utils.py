@@ -39,6 +39,9 @@ def test_line_reader():
     assert list(line_reader("hi \\\n # comment\nthere")) == [(0, 0, "hi there")]
     assert list(line_reader("hi \\\n # comment \\\nthere")) == [(0, 0, "hi there")]
     assert not list(line_reader("\n\n\n"))
+    assert list(line_reader("hi\r\n\r\nthere")) == [(0, 0, "hi"), (6, 2, "there")]
+    assert list(line_reader("hi\r\rthere\r")) == [(0, 0, "hi"), (4, 2, "there")]
+    assert list(line_reader("hi \\\r\nthere")) == [(0, 0, "hi there")]
 
 
 @pytest.mark.unit
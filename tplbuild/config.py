@@ -1,8 +1,6 @@
 import functools
 import os
-import ssl
-import uuid
-from typing import Any, Dict, List, Literal, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple
 
 import jinja2
 import pydantic
@@ -10,10 +8,16 @@ import yaml
 
 from .exceptions import TplBuildException, TplBuildTemplateException
 
+if TYPE_CHECKING:
+    import ssl
+
+#: Default number of build jobs, computed once at import time.
+_CPU_COUNT: int = os.cpu_count() or 4
+
 
 def _normalize_rel_path(path: str) -> str:
     """Normalize and coerce a path into a relative path."""
-    return f".{os.path.sep}{os.path.normpath(os.path.join(os.path.sep, path))[1:]}"
+    return f".{os.path.sep}{os.path.normpath(os.path.sep + path).lstrip(os.path.sep)}"
 
 
 class BaseModel(pydantic.BaseModel):
@@ -46,12 +50,17 @@ class TplContextConfig(BaseModel):
     #: Ignore file string. If present this will be used over :attr:`ignore_file`.
     ignore: Optional[str] = None
 
+    class Config:
+        """Context configs are never modified after loading"""
+
+        frozen = True
+
     @pydantic.validator("umask")
     def umask_valid_octal(cls, v):
         """Ensure that umask is three-digit octal sequence"""
         if v is None:
             return v
-        if 0 <= int(v, 8) <= 0o777:
+        if not 0 <= int(v, 8) <= 0o777:
             raise ValueError("umask out of range")
         return v
 
@@ -61,6 +70,23 @@ class TplContextConfig(BaseModel):
         return _normalize_rel_path(v)
 
 
+#: Shared default build context. Context configs are frozen so one instance
+#: can be used by every config that does not define its own contexts.
+_DEFAULT_CONTEXT = TplContextConfig()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_command_template(
+    jinja_env: jinja2.Environment, template: str
+) -> jinja2.Template:
+    """
+    Compile a client command template, caching the result so that each
+    template is only parsed once per environment rather than on every
+    command invocation.
+    """
+    return jinja_env.from_string(template)
+
+
 class ClientCommand(BaseModel):
     """Configuration to invoke an external build command."""
 
@@ -72,6 +98,11 @@ class ClientCommand(BaseModel):
     #: to invoke the build command. The output of the template will be ignored.
     template: str
 
+    class Config:
+        """Client commands are never modified after loading"""
+
+        frozen = True
+
     def render(
         self,
         jinja_env: jinja2.Environment,
@@ -85,7 +116,7 @@ class ClientCommand(BaseModel):
         environment: Dict[str, str] = {}
 
         try:
-            for _ in jinja_env.from_string(self.template).generate(
+            for _ in _compile_command_template(jinja_env, self.template).generate(
                 **params,
                 args=args,
                 environment=environment,
@@ -96,7 +127,6 @@ class ClientCommand(BaseModel):
                 "Failed to render command template"
             ) from exc
         if not args:
-            print(self.template)
             raise TplBuildException("command template rendered no command arguments")
         return args, environment
 
@@ -143,6 +173,12 @@ class ClientConfig(BaseModel):
     #: Arguments:
     #:   image: str - The name of the image to untag
     untag: ClientCommand
+    #: Bulk un-tag command config template. If set this will be used instead
+    #: of :attr:`untag` to untag several images with a single command.
+    #:
+    #: Arguments:
+    #:   images: List[str] - The names of the images to untag
+    untag_bulk: Optional[ClientCommand] = None
     #: Command that should print out the default build platform for the client.
     #: This template is passed no additional arguments. If this command is not
     #: available the default build platform will be calculated using the local
@@ -152,14 +188,6 @@ class ClientConfig(BaseModel):
     platform: Optional[ClientCommand] = None
 
 
-UNSET_CLIENT_CONFIG = ClientConfig(
-    build=ClientCommand(template=""),
-    tag=ClientCommand(template=""),
-    push=ClientCommand(template=""),
-    untag=ClientCommand(template=""),
-)
-
-
 @functools.lru_cache
 def get_builtin_configs() -> Dict[str, ClientConfig]:
     """
@@ -190,8 +218,11 @@ class UserSSLContext(BaseModel):
     #: loaded if those are all unset.
     load_default_certs: bool = False
 
-    def create_context(self) -> ssl.SSLContext:
+    def create_context(self) -> "ssl.SSLContext":
         """Returns a SSLContext constructed from the passed options"""
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        import ssl
+
         ctx = ssl.create_default_context(
             cafile=self.cafile,
             capath=self.capath,
@@ -251,7 +282,7 @@ class UserConfig(BaseModel):
     #: a default configuration will be provided based on the value of
     #: :attr:`client_type`. If you wish to use a different builder or supply
     #: additional arguments to the build this would be the place to do it.
-    client: ClientConfig = UNSET_CLIENT_CONFIG
+    client: Optional[ClientConfig] = None
     #: Maximum number of concurrent build jbs. If set to 0 this will be set to
     #: `os.cpu_count()`.
     build_jobs: int = 0
@@ -277,29 +308,22 @@ class UserConfig(BaseModel):
     def build_jobs_valid(cls, v):
         """ensure build_jobs is non-negative"""
         if v == 0:
-            return os.cpu_count() or 4
+            return _CPU_COUNT
         if v < 0:
             raise ValueError("build_jobs must be non-negative")
         return v
 
-    @pydantic.validator("push_jobs")
-    def push_jobs_valid(cls, v):
-        """ensure push_jobs is positive"""
-        if v <= 0:
-            raise ValueError("push_jobs must be positive")
-        return v
-
-    @pydantic.validator("tag_jobs")
-    def tag_jobs_valid(cls, v):
-        """ensure tag_jobs is positive"""
+    @pydantic.validator("push_jobs", "tag_jobs")
+    def jobs_positive(cls, v):
+        """ensure push_jobs and tag_jobs are positive"""
         if v <= 0:
-            raise ValueError("push_jobs must be positive")
+            raise ValueError("must be positive")
         return v
 
     @pydantic.validator("client", always=True)
     def default_replace_client(cls, v, values):
         """replace client with client_type if unset"""
-        if v.build.template:
+        if v is not None:
             return v
         client_type = values["client_type"]
         v = get_builtin_configs().get(client_type)
@@ -354,7 +378,9 @@ class TplConfig(BaseModel):
     #:     will be used as the default build context. Otherwise the first
     #:     listed context will be treated as the default. Any COPY instruction
     # ;     may use --from=context_name to copy from a specific named context.
-    contexts: Dict[str, TplContextConfig] = {"default": TplContextConfig()}
+    contexts: Dict[str, TplContextConfig] = pydantic.Field(
+        default_factory=lambda: {"default": _DEFAULT_CONTEXT}
+    )
     #: A mapping of stage names to stage configs. This can be used to override
     #: the default behavior of tplbuild or apply different or more than just a
     #: single image name to a given stage. See
@@ -376,16 +402,11 @@ class TplConfig(BaseModel):
         return v
 
     @pydantic.validator("profiles")
-    def profile_not_empty(cls, v):
-        """Make sure there is at least one profile"""
+    def profiles_valid(cls, v):
+        """Make sure there is at least one profile and all names are non-empty"""
         if not v:
             raise ValueError("profiles cannot be empty")
-        return v
-
-    @pydantic.validator("profiles")
-    def profile_name_nonempty(cls, v):
-        """Make sure all profile names are non-empty"""
-        if any(profile_name == "" for profile_name in v):
+        if "" in v:
             raise ValueError("profile name cannot be empty")
         return v
 
@@ -437,12 +458,16 @@ class BuildData(BaseModel):
     #: A string combined with the base image definition hashes to produce
     #: the final hash for base images. This ensures that different projects
     #: use disjoint hash spaces, that the base image keys bear no information
-    #: by themselves, and to force rebuilds by changing the salt.
+    #: by themselves, and to force rebuilds by changing the salt. Use
+    #: :meth:`get_hash_salt` to read the salt; it is generated lazily the
+    #: first time it is needed.
     hash_salt: str = ""
 
-    @pydantic.validator("hash_salt", always=True)
-    def default_profile_exists(cls, v):
-        """Fill in hash salt if not set"""
-        if not v:
-            return str(uuid.uuid4())
-        return v
+    def get_hash_salt(self) -> str:
+        """Return the hash salt, filling it in if not set"""
+        if not self.hash_salt:
+            # pylint: disable=import-outside-toplevel
+            import uuid
+
+            self.hash_salt = str(uuid.uuid4())
+        return self.hash_salt
@@ -1,25 +1,114 @@
+import concurrent.futures
+import errno
 import functools
 import io
 import os.path
 import re
 import stat
 import tarfile
-from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import time
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from . import hashing
 from .exceptions import TplBuildContextException, TplBuildException
 
+#: Size of the writes made to the output stream by
+#: :meth:`BuildContext.write_context`.
+_WRITE_BUFFER_SIZE = 2**16
 
-@functools.lru_cache(maxsize=2**16)
-def _hash_file(path: str) -> str:
+#: Files at least this large are copied into uncompressed contexts with
+#: os.sendfile when writing to a file descriptor.
+_SENDFILE_MIN_SIZE = 2**16
+
+#: Cache of file content hashes keyed by
+#: (abspath, st_dev, st_ino, st_mtime_ns, st_size).
+_FILE_HASH_CACHE: Dict[Tuple[str, int, int, int, int], str] = {}
+_FILE_HASH_CACHE_MAX = 2**16
+
+#: Files modified this recently (in nanoseconds) are not cached; on file
+#: systems with coarse timestamps they could still change without their
+#: modification time changing.
+_FILE_HASH_RACY_NS = 2 * 10**9
+
+#: Number of threads used to hash files that are not already cached.
+_HASH_WORKERS = os.cpu_count() or 4
+
+#: A file's content hash, a pending computation of it, or None for non-files.
+_PendingFileHash = Union[None, str, "concurrent.futures.Future[str]"]
+
+
+def _file_hash_key(
+    path: str, statres: os.stat_result
+) -> Tuple[str, int, int, int, int]:
+    """
+    Returns the `_FILE_HASH_CACHE` key for a file's path and stat result. The
+    path is included as st_dev and st_ino are not reliable on every platform.
+    """
+    return (
+        os.path.abspath(path),
+        statres.st_dev,
+        statres.st_ino,
+        statres.st_mtime_ns,
+        statres.st_size,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Returns the shared executor used to hash context files. Worker threads are
+    only started as work is submitted and are reused across contexts.
+    """
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=_HASH_WORKERS, thread_name_prefix="tplbuild-hash"
+    )
+
+
+def _hash_file(path: str, statres: Optional[os.stat_result] = None) -> str:
     """
-    Hash the passed file, cache the result.
+    Hash the passed file, cache the result. Results are keyed by the file's
+    path, device, inode, modification time, and size so unchanged files are
+    only read once and modified files are always re-read. Recently modified
+    files are not cached. `statres` may be passed if the file has already been
+    stat'ed.
     """
-    hsh = hashing.HASHER()
+    if statres is None:
+        statres = os.stat(path)
+    key = _file_hash_key(path, statres)
+    digest = _FILE_HASH_CACHE.get(key)
+    if digest is not None:
+        return digest
+
     with open(path, "rb") as fdata:
-        while data := fdata.read(2**16):
-            hsh.update(data)
-    return hsh.hexdigest()
+        digest = hashing.hash_file(fdata)
+
+    if time.time_ns() - statres.st_mtime_ns < _FILE_HASH_RACY_NS:
+        return digest
+    if len(_FILE_HASH_CACHE) >= _FILE_HASH_CACHE_MAX:
+        _FILE_HASH_CACHE.clear()
+    _FILE_HASH_CACHE[key] = digest
+    return digest
+
+
+#: Regex character class matching any character except a path separator.
+_NON_SEP = f"[^{re.escape(os.path.sep)}]"
+
+#: Matches a run of characters with no special meaning in a character class.
+_CCLASS_LITERALS = re.compile(r"[^\\\]-]+", re.DOTALL)
+
+#: Splits a pattern part into literal runs, escapes, wildcards, and the
+#: start of character classes.
+_PATTERN_TOKEN = re.compile(r"[^\\*?\[]+|\\(.?)|[*?]|\[", re.DOTALL)
 
 
 def _create_pattern_part(
@@ -46,20 +135,23 @@ def _create_pattern_part(
 
     i = 0
     while i < len(path_pat):
-        ch = path_pat[i]
-        i += 1
+        token = _PATTERN_TOKEN.match(path_pat, i)
+        assert token is not None
+        i = token.end()
+        ch = token.group()[0]
 
         if ch == "\\":
-            if i == len(path_pat):
+            if not token.group(1):
                 raise ValueError("Trailing escape character")
-            result.append(re.escape(path_pat[i]))
-            i += 1
+            result.append(re.escape(token.group(1)))
         elif ch in "*?":
             simple = False
-            result.append(f"[^{os.path.sep}]{ch}")
+            result.append(_NON_SEP)
+            result.append(ch)
         elif ch == "[":
             simple = False
             range_start = None
+            last_ch = ""
             cclass_empty = True
             char_avail = False
             result.append("[")
@@ -73,6 +165,17 @@ def _create_pattern_part(
                 if i == len(path_pat):
                     raise ValueError("Unclosed character class")
 
+                if range_start is None:
+                    # Consume runs of plain characters in one step
+                    literals = _CCLASS_LITERALS.match(path_pat, i)
+                    if literals is not None:
+                        i = literals.end()
+                        last_ch = path_pat[i - 1]
+                        result.append(re.escape(literals.group()))
+                        char_avail = True
+                        cclass_empty = False
+                        continue
+
                 ch = path_pat[i]
                 i += 1
 
@@ -90,7 +193,7 @@ def _create_pattern_part(
                 elif ch == "-":
                     if not char_avail:
                         raise ValueError("Unexpected '-' in character class")
-                    range_start = result[-1]
+                    range_start = last_ch
                     result.append("-")
                     char_avail = False
                     continue
@@ -101,12 +204,13 @@ def _create_pattern_part(
                     range_start = None
                 else:
                     char_avail = True
+                last_ch = ch
                 result.append(re.escape(ch))
                 cclass_empty = False
 
             result.append("]")
         else:
-            result.append(re.escape(ch))
+            result.append(re.escape(token.group()))
 
     return "".join(result), simple
 
@@ -133,9 +237,47 @@ def _create_pattern(
             + "".join(pat for pat, _ in pattern_parts)
             + f"(?:$|{re.escape(os.path.sep)})"
         )
+    return _nest_pattern_parts([pat for pat, _ in pattern_parts])
+
+
+def _has_char_class(path_pat: str) -> bool:
+    """Returns True if the pattern part contains a character class"""
+    i = 0
+    while i < len(path_pat):
+        token = _PATTERN_TOKEN.match(path_pat, i)
+        assert token is not None
+        if token.group() == "[":
+            return True
+        i = token.end()
+    return False
+
 
+def _create_subtree_pattern(path_pat: str) -> str:
+    """
+    Compile a full path pattern with separators into a regex that matches
+    a directory path if the pattern, with or without prefix matching, could
+    match the directory or anything beneath it. This may produce false
+    positives but never false negatives.
+
+    Character classes may match a path separator so matching stops at the
+    first part containing one; anything beneath the preceding parts matches.
+    """
+    pattern_parts = []
+    for path_part in path_pat.split(os.path.sep):
+        if _has_char_class(path_part):
+            pattern_parts.append(re.escape(os.path.sep) + ".*")
+            break
+        pattern_parts.append(_create_pattern_part(path_part)[0])
+    return _nest_pattern_parts(pattern_parts)
+
+
+def _nest_pattern_parts(pattern_parts: List[str]) -> str:
+    """
+    Join compiled pattern parts into a regex that matches any path that the
+    parts would match along with any prefix of path components of those paths.
+    """
     result = ["^"]
-    for pat_part, _ in pattern_parts:
+    for pat_part in pattern_parts:
         result.append(pat_part)
         result.append("(?:$|")
     result.append(re.escape(os.path.sep))
@@ -144,6 +286,28 @@ def _create_pattern(
     return "".join(result)
 
 
+@functools.lru_cache(maxsize=4096)
+def _compile_context_pattern(pattern: str) -> Tuple[bool, re.Pattern, re.Pattern]:
+    """
+    Returns the (ignoring, pattern, subtree_pattern) attributes for a
+    :class:`ContextPattern`. Build contexts for different stages typically
+    share most of their ignore patterns so these are cached.
+
+    Raises a ValueError if the pattern is malformed.
+    """
+    if pattern.startswith("!"):
+        return (
+            False,
+            re.compile(_create_pattern(pattern[1:], True)),
+            re.compile(_create_subtree_pattern(pattern[1:])),
+        )
+    return (
+        True,
+        re.compile(_create_pattern(pattern, False)),
+        re.compile(_create_subtree_pattern(pattern)),
+    )
+
+
 class ContextPattern:
     """
     Represents a pattern used to control what files are availble in a
@@ -152,25 +316,24 @@ class ContextPattern:
     Attributes:
         ignoring (bool): Flag indicating if matching this pattern means the
             matched element should be ignored or not ignored.
+        pattern (re.Pattern): Regex that matches the paths this pattern
+            applies to. Patterns are evaluated together by :class:`_PatternSet`.
+        subtree_pattern (re.Pattern): Regex that matches directories that
+            this pattern could match or contain paths this pattern could match.
     """
 
     def __init__(self, pattern: str):
         try:
-            if pattern.startswith("!"):
-                self.ignoring = False
-                self.pattern = re.compile(_create_pattern(pattern[1:], True))
-            else:
-                self.ignoring = True
-                self.pattern = re.compile(_create_pattern(pattern, False))
+            (
+                self.ignoring,
+                self.pattern,
+                self.subtree_pattern,
+            ) = _compile_context_pattern(pattern)
         except ValueError as exc:
             raise TplBuildContextException(
                 f"Error handling {repr(pattern)}: {exc}"
             ) from exc
 
-    def matches(self, path: str) -> bool:
-        """Returns True if this pattern matches the path"""
-        return bool(self.pattern.search(path))
-
 
 def _apply_umask(mode: int, umask: Optional[int]) -> int:
     """
@@ -179,23 +342,36 @@ def _apply_umask(mode: int, umask: Optional[int]) -> int:
     """
     if umask is None:
         return mode
-    umode = (mode >> 6) & 0o7
-    mode &= ~0o777
-    mode |= ((umode << 6) | (umode << 3) | umode) & ~umask
-    return mode
+    return (mode & ~0o777) | _umask_table(umask)[(mode >> 6) & 0o7]
+
+
+@functools.lru_cache(maxsize=None)
+def _umask_table(umask: int) -> Tuple[int, ...]:
+    """
+    Returns the permission bits produced by `_apply_umask` for each of the
+    eight possible user permission values under `umask`.
+    """
+    return tuple(((umode << 6) | (umode << 3) | umode) & ~umask for umode in range(8))
 
 
 def _stat_to_tarinfo(
-    base_path: str, arch_path: str, *, umask: Optional[int] = None, follow_link=True
+    base_path: str,
+    arch_path: str,
+    *,
+    umask: Optional[int] = None,
+    follow_link=True,
+    statres: Optional[os.stat_result] = None,
 ) -> tarfile.TarInfo:
     """
-    Convert a stat_result into a TarInfo structure.
+    Convert a stat_result into a TarInfo structure. If `statres` is passed
+    it will be used instead of stat'ing the path again.
     """
     tarinfo = tarfile.TarInfo()
-    if follow_link:
-        statres = os.stat(os.path.join(base_path, arch_path))
-    else:
-        statres = os.lstat(os.path.join(base_path, arch_path))
+    if statres is None:
+        if follow_link:
+            statres = os.stat(os.path.join(base_path, arch_path))
+        else:
+            statres = os.lstat(os.path.join(base_path, arch_path))
 
     linkname = ""
     stmd = statres.st_mode
@@ -241,6 +417,93 @@ def _stat_to_tarinfo(
     return tarinfo
 
 
+def _tarinfo_hash(tarinfo: tarfile.TarInfo) -> str:
+    """Returns the hash of a TarInfo's metadata as used in context hashes"""
+    info = tarinfo.get_info()
+    info["type"] = info["type"].decode("utf-8")  # type: ignore
+    return hashing.json_hash(info)
+
+
+def _copy_exact(io_out, fileobj, size: int) -> None:
+    """
+    Copy exactly `size` bytes from `fileobj` to `io_out`. Raises an OSError if
+    `fileobj` ends early, like tarfile does when a file shrinks while being
+    archived.
+    """
+    while size > 0:
+        data = fileobj.read(min(size, _WRITE_BUFFER_SIZE))
+        if not data:
+            raise OSError("unexpected end of data")
+        io_out.write(data)
+        size -= len(data)
+
+
+def _sendfile_exact(out_fd: int, in_fd: int, size: int) -> bool:
+    """
+    Copy exactly `size` bytes from the start of `in_fd` to `out_fd` using
+    `os.sendfile`. Returns False without copying anything if sendfile cannot
+    write to `out_fd` on this platform. Raises an OSError if `in_fd` ends
+    early.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+        except OSError as exc:
+            if offset == 0 and exc.errno in (errno.EINVAL, errno.ENOTSOCK):
+                return False
+            raise
+        if not sent:
+            raise OSError("unexpected end of data")
+        offset += sent
+    return True
+
+
+class _PatternSet:
+    """
+    Matches paths against an ordered sequence of context patterns at once.
+    All patterns are combined into a single alternation, listed in reverse
+    order with one capture group each. Every pattern is anchored so the first
+    alternative to match is the last matching pattern in the sequence, which
+    is the one that decides if a path is ignored.
+
+    Negated patterns that come before any ignore pattern can never change the
+    result and are dropped. If no negated patterns remain then any match
+    means the path is ignored and the capture groups are omitted.
+    """
+
+    def __init__(self, patterns: Sequence[ContextPattern]) -> None:
+        self.combined_pattern: Optional[re.Pattern] = None
+        #: Maps capture group indices back to pattern polarity, or None if
+        #: every pattern in the combined pattern is an ignore pattern.
+        self.ignoring: Optional[Tuple[bool, ...]] = None
+
+        first_ignoring = next(
+            (i for i, pat in enumerate(patterns) if pat.ignoring), len(patterns)
+        )
+        patterns = patterns[first_ignoring:]
+        if not patterns:
+            return
+        if all(pat.ignoring for pat in patterns):
+            self.combined_pattern = re.compile(
+                "|".join(f"(?:{pat.pattern.pattern})" for pat in patterns)
+            )
+            return
+        self.combined_pattern = re.compile(
+            "|".join(f"({pat.pattern.pattern})" for pat in reversed(patterns))
+        )
+        self.ignoring = (False,) + tuple(pat.ignoring for pat in reversed(patterns))
+
+    def ignored(self, path: str) -> bool:
+        """Returns True if the last pattern matching `path` is not negated"""
+        if self.combined_pattern is None:
+            return False
+        match = self.combined_pattern.match(path)
+        if match is None:
+            return False
+        return self.ignoring is None or self.ignoring[match.lastindex or 0]
+
+
 class BuildContext:
     """
     Class representing and capable of writing a build context.
@@ -267,24 +530,118 @@ class BuildContext:
         self.base_dir = base_dir
         self.umask = umask
         self.context_patterns = tuple(
-            ContextPattern(pattern.strip())
-            for pattern in ignore_patterns
-            if pattern.strip() and pattern.strip()[0] != "#"
+            ContextPattern(pattern)
+            for pattern in (pattern.strip() for pattern in ignore_patterns)
+            if pattern and pattern[0] != "#"
         )
 
+        # Pattern sets keyed by the indices of the patterns they contain. While
+        # walking the context each directory only tests its children against
+        # the patterns that could match something beneath it.
+        all_indices = tuple(range(len(self.context_patterns)))
+        self._pattern_sets: Dict[Tuple[int, ...], _PatternSet] = {
+            (): _PatternSet(()),
+            all_indices: _PatternSet(self.context_patterns),
+        }
+        self._all_pattern_indices = all_indices
+
     def ignored(self, path: str):
         """
         Returns True if the given path should be ignored (not present) in
         the build contxt. `path` should start with a directory separator
         and should be relative to `self.base_dir`.
         """
-        ignored = False
-        for pattern in self.context_patterns:
-            if pattern.ignoring == ignored:
+        return self._pattern_sets[self._all_pattern_indices].ignored(path)
+
+    def _get_pattern_set(self, indices: Tuple[int, ...]) -> _PatternSet:
+        """Returns the (cached) pattern set for the given pattern indices"""
+        pattern_set = self._pattern_sets.get(indices)
+        if pattern_set is None:
+            pattern_set = _PatternSet([self.context_patterns[i] for i in indices])
+            self._pattern_sets[indices] = pattern_set
+        return pattern_set
+
+    def _walk_dir(
+        self,
+        arch_root: str,
+        ignore_func: Optional[Callable[[str], bool]],
+        statres: Optional[os.stat_result] = None,
+        pattern_indices: Optional[Tuple[int, ...]] = None,
+    ) -> Iterable[Tuple[tarfile.TarInfo, Optional[os.stat_result]]]:
+        """
+        Yield (TarInfo, stat_result) pairs for the directory `arch_root`,
+        relative to `self.base_dir`, followed by its non-ignored files and then
+        recursively its non-ignored sub-directories, each in sorted order. Stat
+        results from the directory scan are reused for each entry and yielded
+        alongside it; the stat result of the walk root is None. Like `os.walk`,
+        directories that cannot be listed are skipped and symbolic links to
+        directories are not followed.
+
+        `pattern_indices` lists the context patterns that could match anything
+        beneath `arch_root`, or None to use all of them.
+        """
+        assert self.base_dir is not None
+        try:
+            with os.scandir(os.path.join(self.base_dir, arch_root)) as entries:
+                dir_entries = list(entries)
+        except OSError:
+            return
+
+        tarinfo = _stat_to_tarinfo(
+            self.base_dir, arch_root, umask=self.umask, statres=statres
+        )
+        yield tarinfo, statres
+
+        if pattern_indices is None:
+            pattern_indices = self._all_pattern_indices
+        pattern_set = self._get_pattern_set(pattern_indices)
+
+        # Archive names of children are built by concatenation onto the
+        # directory's own name rather than with os.path.join. The matching
+        # `arch_root` relative path is just the name prefixed with ".".
+        name_prefix = tarinfo.name.rstrip(os.path.sep) + os.path.sep
+        file_entries = []
+        sub_dir_entries = []
+        for entry in dir_entries:
+            path = name_prefix + entry.name
+            if pattern_set.ignored(path):
+                continue
+            if ignore_func is not None and ignore_func(path):
                 continue
-            if pattern.matches(path):
-                ignored = pattern.ignoring
-        return ignored
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                sub_dir_entries.append((entry, path))
+            else:
+                file_entries.append((entry, path))
+
+        file_entries.sort(key=lambda item: item[0].name)
+        sub_dir_entries.sort(key=lambda item: item[0].name)
+
+        for entry, path in file_entries:
+            entry_statres = entry.stat(follow_symlinks=False)
+            yield _stat_to_tarinfo(
+                self.base_dir,
+                "." + path,
+                umask=self.umask,
+                statres=entry_statres,
+            ), entry_statres
+
+        for entry, path in sub_dir_entries:
+            if entry.is_symlink():
+                continue
+            yield from self._walk_dir(
+                "." + path,
+                ignore_func,
+                entry.stat(follow_symlinks=False),
+                tuple(
+                    i
+                    for i in pattern_indices
+                    if self.context_patterns[i].subtree_pattern.match(path)
+                ),
+            )
 
     def walk_context(
         self,
@@ -297,42 +654,15 @@ class BuildContext:
         in the context. Objects are yielded in a deterministic order based on the
         names.
         """
-
-        def _is_ignored(path: str) -> bool:
-            if self.ignored(path):
-                return True
-            return ignore_func is not None and ignore_func(path)
-
         if self.base_dir is None:
             tarinfo = tarfile.TarInfo("/")
             tarinfo.mode = _apply_umask(0o777, self.umask)
             tarinfo.type = tarfile.DIRTYPE
             yield tarinfo
         else:
-            for root, dir_names, file_names in os.walk(self.base_dir):
-                arch_root = os.path.relpath(root, self.base_dir)
-                tarinfo = _stat_to_tarinfo(self.base_dir, arch_root, umask=self.umask)
+            for tarinfo, _ in self._walk_dir(".", ignore_func):
                 yield tarinfo
 
-                file_names[:] = sorted(
-                    file_name
-                    for file_name in file_names
-                    if not _is_ignored(os.path.join(tarinfo.name, file_name))
-                )
-                dir_names[:] = sorted(
-                    dir_name
-                    for dir_name in dir_names
-                    if not _is_ignored(os.path.join(tarinfo.name, dir_name))
-                )
-
-                for file_name in file_names:
-                    yield _stat_to_tarinfo(
-                        self.base_dir,
-                        os.path.join(arch_root, file_name),
-                        umask=self.umask,
-                        follow_link=False,
-                    )
-
         extra_files = extra_files or {}
         for file_name, (file_mode, file_data) in extra_files.items():
             tarinfo = tarfile.TarInfo(file_name)
@@ -358,10 +688,22 @@ class BuildContext:
         """
         extra_files = extra_files or {}
 
+        if not compress:
+            try:
+                out_fd = io_out.fileno()
+            except (AttributeError, OSError):
+                pass
+            else:
+                self._write_tar_to_fd(io_out, out_fd, extra_files)
+                return
+
+        # Stream mode writes to `io_out` in `bufsize` chunks (default 10KiB);
+        # use larger writes to cut down on calls into the output stream.
         with tarfile.open(
             fileobj=io_out,
             format=tarfile.PAX_FORMAT,
             mode=("w|gz" if compress else "w|"),
+            bufsize=_WRITE_BUFFER_SIZE,
         ) as tf:
             for tarinfo in self.walk_context(extra_files=extra_files):
                 if tarinfo.type == tarfile.REGTYPE:
@@ -377,6 +719,66 @@ class BuildContext:
                 else:
                     tf.addfile(tarinfo)
 
+    def _write_tar_to_fd(
+        self,
+        io_out: BinaryIO,
+        out_fd: int,
+        extra_files: Dict[str, Tuple[int, bytes]],
+    ) -> None:
+        """
+        Write the context as an uncompressed tar file to `io_out`. This needs a
+        binary stream backed by a real file descriptor, `out_fd`, such as a
+        regular file or pipe; in-memory streams are not supported. The output
+        is byte-for-byte identical to what tarfile's stream mode produces.
+        Headers and small files are written through `io_out`, while the
+        contents of large files are copied from the source file to `out_fd`
+        with `os.sendfile` where the platform supports it, avoiding a copy
+        through userspace.
+        """
+        use_sendfile = hasattr(os, "sendfile")
+        offset = 0
+
+        for tarinfo in self.walk_context(extra_files=extra_files):
+            header = tarinfo.tobuf(
+                tarfile.PAX_FORMAT, tarfile.ENCODING, "surrogateescape"
+            )
+            io_out.write(header)
+            offset += len(header)
+            if tarinfo.type != tarfile.REGTYPE or not tarinfo.size:
+                continue
+
+            extra_data = extra_files.get(tarinfo.name)
+            if extra_data:
+                io_out.write(extra_data[1])
+            else:
+                assert self.base_dir is not None
+                with open(
+                    os.path.join(self.base_dir, "." + tarinfo.name), "rb"
+                ) as fileobj:
+                    if use_sendfile and tarinfo.size >= _SENDFILE_MIN_SIZE:
+                        io_out.flush()
+                        use_sendfile = _sendfile_exact(
+                            out_fd, fileobj.fileno(), tarinfo.size
+                        )
+                        if not use_sendfile:
+                            _copy_exact(io_out, fileobj, tarinfo.size)
+                    else:
+                        _copy_exact(io_out, fileobj, tarinfo.size)
+
+            offset += tarinfo.size
+            remainder = tarinfo.size % tarfile.BLOCKSIZE
+            if remainder:
+                io_out.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                offset += tarfile.BLOCKSIZE - remainder
+
+        # End of archive marker, padded out to a full record like tarfile does.
+        offset += 2 * tarfile.BLOCKSIZE
+        io_out.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        remainder = offset % tarfile.RECORDSIZE
+        if remainder:
+            io_out.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        io_out.flush()
+
     def compute_partial_hash(
         self,
         *,
@@ -394,20 +796,36 @@ class BuildContext:
         def _ignore_func(path: str) -> bool:
             return not any(pat.search(path) for pat in pats)
 
+        # Walk the context once, resolving file hashes from the cache where
+        # possible and handing the rest to the shared hash executor as they
+        # are found. Results are consumed in walk order so the final digest is
+        # deterministic.
+        entries: List[Tuple[str, _PendingFileHash]] = []
+        if self.base_dir is None:
+            entries.extend(
+                (_tarinfo_hash(tarinfo), None) for tarinfo in self.walk_context()
+            )
+        else:
+            executor = _hash_executor()
+            for tarinfo, statres in self._walk_dir(
+                ".", _ignore_func if patterns else None
+            ):
+                file_hash: _PendingFileHash = None
+                if tarinfo.type == tarfile.REGTYPE:
+                    assert statres is not None
+                    file_path = os.path.join(self.base_dir, "." + tarinfo.name)
+                    file_hash = _FILE_HASH_CACHE.get(_file_hash_key(file_path, statres))
+                    if file_hash is None:
+                        file_hash = executor.submit(_hash_file, file_path, statres)
+                entries.append((_tarinfo_hash(tarinfo), file_hash))
+
         hsh = hashing.HASHER()
-        for tarinfo in self.walk_context(
-            ignore_func=_ignore_func if patterns else None
-        ):
-            info = tarinfo.get_info()
-            info["type"] = info["type"].decode("utf-8")  # type: ignore
-            hsh.update(hashing.json_hash(info).encode("utf-8"))
-            if tarinfo.type == tarfile.REGTYPE:
-                assert self.base_dir is not None
-                hsh.update(
-                    _hash_file(os.path.join(self.base_dir, "." + tarinfo.name)).encode(
-                        "utf-8"
-                    )
-                )
+        for info_hash, file_hash in entries:
+            hsh.update(info_hash.encode("utf-8"))
+            if isinstance(file_hash, concurrent.futures.Future):
+                file_hash = file_hash.result()
+            if file_hash is not None:
+                hsh.update(file_hash.encode("utf-8"))
 
         return hashing.json_hash(
             [
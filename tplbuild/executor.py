@@ -3,18 +3,8 @@ import logging
 import os
 import uuid
 from asyncio.subprocess import DEVNULL, PIPE
-from dataclasses import dataclass
-from typing import (
-    Any,
-    AsyncIterable,
-    Awaitable,
-    Callable,
-    Dict,
-    List,
-    Optional,
-    Set,
-    Tuple,
-)
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 import jinja2
 from aioregistry import (
@@ -42,11 +32,13 @@ from .images import (
 )
 from .output import OutputStream
 from .plan import BuildOperation
-from .sync_to_async_pipe import SyncToAsyncPipe
 from .tplbuild import TplBuild
 
 LOGGER = logging.getLogger(__name__)
 
+# Maximum amount of subprocess output to read at once.
+_READ_CHUNK_SIZE = 2**16
+
 
 @async_exit_context
 async def _create_subprocess(
@@ -56,22 +48,37 @@ async def _create_subprocess(
     *,
     capture_output: bool = False,
     output_stream: Optional[OutputStream] = None,
-    input_data: Optional[AsyncIterable[bytes]] = None,
+    stdin_fd: Optional[int] = None,
 ) -> bytes:
     """
     Create a subprocess and process its streams.
+
+    If `stdin_fd` is passed the subprocess will read its input directly from
+    that file descriptor. Ownership of the descriptor passes to this function;
+    it is closed once the subprocess has been started (or failed to start) so
+    that writers see a broken pipe if the subprocess exits early.
     """
-    env = dict(os.environ)
-    render_args, render_env = cmd.render(jinja_env, params)
-    env.update(render_env)
-    proc = await asyncio.create_subprocess_exec(
-        *render_args,
-        stdout=PIPE,
-        stderr=PIPE,
-        stdin=DEVNULL if input_data is None else PIPE,
-        env=env,
-    )
-    assert proc.stdout is not None and proc.stderr is not None
+    try:
+        render_args, render_env = cmd.render(jinja_env, params)
+
+        # Only build a new environment when the command template actually set
+        # variables; otherwise let the child inherit ours directly.
+        env = None
+        if render_env:
+            env = dict(os.environ)
+            env.update(render_env)
+        # Streams that nobody would read are sent straight to /dev/null
+        # rather than being piped back and discarded.
+        proc = await asyncio.create_subprocess_exec(
+            *render_args,
+            stdout=PIPE if capture_output or output_stream is not None else DEVNULL,
+            stderr=PIPE if output_stream is not None else DEVNULL,
+            stdin=DEVNULL if stdin_fd is None else stdin_fd,
+            env=env,
+        )
+    finally:
+        if stdin_fd is not None:
+            os.close(stdin_fd)
 
     async def copy_lines(
         src: asyncio.StreamReader,
@@ -81,42 +88,41 @@ async def _create_subprocess(
     ) -> None:
         """
         Copy lines of output from src to dst. It's assumed that dst is a non
-        blocking output stream.
+        blocking output stream. Output is read in large chunks and all complete
+        lines in a chunk are forwarded together; a trailing partial line is
+        held until the rest of it arrives.
         """
-        while not src.at_eof():
-            line = await src.readline()
-            if not line:
-                continue
+        partial = b""
+        while data := await src.read(_READ_CHUNK_SIZE):
             if output_arr is not None:
-                output_arr.append(line)
-            if output_stream is not None:
-                await output_stream.write(line, err=err)
-
-    async def copy_input_data():
-        """
-        Copy data from input_data into proc.stdin.
-        """
-        # TODO(msg): Maybe need to disable SIGPIPE/handle write fails here?
-        try:
-            async for data in input_data:
-                proc.stdin.write(data)
-                await proc.stdin.drain()
-            proc.stdin.close()
-            await proc.stdin.wait_closed()
-        except (BrokenPipeError, ConnectionResetError):
-            LOGGER.warning("process exited before finished writing input")
+                output_arr.append(data)
+            if output_stream is None:
+                continue
+            lines = (partial + data).split(b"\n")
+            partial = lines.pop()
+            if lines:
+                await output_stream.write_lines(lines, err=err)
+        if partial and output_stream is not None:
+            await output_stream.write_lines([partial], err=err)
 
     output_arr: List[bytes] = []
-    coros: List[Awaitable] = [
-        copy_lines(proc.stdout, output_arr=output_arr if capture_output else None),
-        copy_lines(proc.stderr, err=True),
-    ]
-    if input_data is not None:
-        coros.append(copy_input_data())
-
-    exit_stack = get_exit_stack()
-    coros.append(proc.wait())
-    await asyncio.gather(*(exit_stack.create_scoped_task(coro) for coro in coros))
+    coros: List[Awaitable] = []
+    if output_stream is None and proc.stdout is not None:
+        # Capture only; stderr is not piped so stdout can be drained inline.
+        output_arr.append(await proc.stdout.read())
+    elif proc.stdout is not None:
+        coros.append(
+            copy_lines(proc.stdout, output_arr=output_arr if capture_output else None)
+        )
+    if proc.stderr is not None:
+        coros.append(copy_lines(proc.stderr, err=True))
+    if coros:
+        exit_stack = get_exit_stack()
+        coros.append(proc.wait())
+        await asyncio.gather(*(exit_stack.create_scoped_task(coro) for coro in coros))
+    else:
+        # Nothing left to copy; avoid creating tasks just to wait on the process.
+        await proc.wait()
 
     if proc.returncode:
         raise TplBuildException(f"Client command failed {render_args}")
@@ -124,6 +130,14 @@ async def _create_subprocess(
     return b"".join(output_arr)
 
 
+def _title_image(img: ImageDefinition) -> str:
+    """Returns a display title for a base or source image being pulled."""
+    if isinstance(img, BaseImage):
+        return f"{img.stage}:{img.profile}:{img.platform}"
+    assert isinstance(img, SourceImage)
+    return f"{img.repo}:{img.tag}:{img.platform}"
+
+
 def _construct_title(data, *, seps=":", depth=0):
     """
     Construct image titles from trie structure.
@@ -206,6 +220,11 @@ class RenderedBuildOperation:
     #: This is the case for example when a base image is created solely from
     #: a source image.
     build_empty: bool
+    #: Remotely stored images the build depends on, mapped to display titles
+    #: used when pulling them.
+    remote_deps: Dict[str, str] = field(default_factory=dict)
+    #: Locally built images the build depends on.
+    local_deps: Set[str] = field(default_factory=set)
 
 
 class BuildExecutor:
@@ -222,12 +241,14 @@ class BuildExecutor:
         self.transient_prefix = "tplbuild"
 
         user_config = tplbld.user_config
+        assert user_config.client is not None
         self.client_config = user_config.client
         self.sem_build_jobs = asyncio.BoundedSemaphore(user_config.build_jobs)
         self.sem_push_jobs = asyncio.BoundedSemaphore(user_config.push_jobs)
         self.sem_tag_jobs = asyncio.BoundedSemaphore(user_config.tag_jobs)
         self.build_retry = user_config.build_retry
         self.push_retry = user_config.push_retry
+        self._base_image_names: Dict[Tuple[BaseImage, Optional[str]], str] = {}
 
     @async_exit_context
     async def build(
@@ -251,7 +272,7 @@ class BuildExecutor:
                 first push tag.
         """
         transient_images: List[str] = []
-        remote_pull_coros: Dict[str, Awaitable] = {}
+        remote_pull_tasks: Dict[str, asyncio.Task] = {}
 
         rendered_ops = self.render_build_ops(build_ops)
         image_tag_map: Dict[ImageDefinition, str] = {
@@ -280,23 +301,20 @@ class BuildExecutor:
                 if isinstance(build_op.image, ContextImage):
                     await self._build_context(primary_tag, build_op.image, build_title)
                 else:
-                    # Pull base images, source images
-                    remote_deps, local_deps = self._get_build_deps(
-                        build_op, image_tag_map
+                    # Wait for pulls of base images, source images
+                    await asyncio.gather(
+                        *(
+                            remote_pull_tasks[remote_ref]
+                            for remote_ref in rendered_op.remote_deps
+                            if remote_ref in remote_pull_tasks
+                        )
                     )
-                    if self.client_config.pull is not None:
-                        for remote_ref, remote_name in remote_deps.items():
-                            if remote_ref not in remote_pull_coros:
-                                remote_pull_coros[remote_ref] = asyncio.create_task(
-                                    self.pull_image(remote_ref, remote_name)
-                                )
-                            await remote_pull_coros[remote_ref]
 
                     await self._build_work(
                         primary_tag,
                         build_op,
                         rendered_op.dockerfile,
-                        local_deps,
+                        rendered_op.local_deps,
                         build_title,
                     )
                 build_done_events[build_op].set()
@@ -304,16 +322,38 @@ class BuildExecutor:
                 if not tags:
                     transient_images.append(primary_tag)
 
-                for tag, push in tags.items():
+                async def _tag_and_push(tag: str, push: bool) -> None:
                     if tag != primary_tag:
                         await self.tag_image(primary_tag, tag)
                     if push:
                         await self.push_image(tag, build_title)
 
+                # Each tag is independent; tag and push them concurrently. The
+                # tasks are scoped so any still running are cancelled if the
+                # build fails.
+                exit_stack = get_exit_stack()
+                await asyncio.gather(
+                    *(
+                        exit_stack.create_scoped_task(_tag_and_push(tag, push))
+                        for tag, push in tags.items()
+                    )
+                )
+
             if complete_callback:
                 await complete_callback(build_op, primary_tag)
 
         stack = get_exit_stack()
+
+        # Start pulling every remote dependency up front so that pulls overlap
+        # with each other and with unrelated builds.
+        if self.client_config.pull is not None:
+            for rendered_op in rendered_ops:
+                for remote_ref, remote_name in rendered_op.remote_deps.items():
+                    if remote_ref not in remote_pull_tasks:
+                        remote_pull_tasks[remote_ref] = stack.create_scoped_task(
+                            self.pull_image(remote_ref, remote_name)
+                        )
+
         build_tasks = {
             build_op: stack.create_scoped_task(_build_single(build_op, rendered_op))
             for build_op, rendered_op in zip(build_ops, rendered_ops)
@@ -328,9 +368,7 @@ class BuildExecutor:
             for task in done:
                 await task
         finally:
-            await asyncio.gather(
-                *(self.untag_image(image) for image in transient_images)
-            )
+            await self.untag_images(transient_images)
 
     async def _build_multi_platform(
         self,
@@ -410,45 +448,6 @@ class BuildExecutor:
             context=image.context,
         )
 
-    def _get_build_deps(
-        self,
-        build_op: BuildOperation,
-        image_tag_map: Dict[ImageDefinition, str],
-    ) -> Tuple[Dict[str, str], Set[str]]:
-        """
-        Return a list of remotely stored images this build depends on.
-        """
-        remote_deps = {}
-        local_deps = set()
-        img = build_op.image
-
-        def _title_image(img):
-            if isinstance(img, BaseImage):
-                return f"{img.stage}:{img.profile}:{img.platform}"
-            assert isinstance(img, SourceImage)
-            return f"{img.repo}:{img.tag}:{img.platform}"
-
-        while img is not build_op.root:
-            if (
-                isinstance(img, CopyCommandImage)
-                and img.context is not build_op.inline_context
-            ):
-                image_name = self._name_image(img.context, image_tag_map)
-                if isinstance(img.context, (BaseImage, SourceImage)):
-                    remote_deps[image_name] = _title_image(img.context)
-                else:
-                    local_deps.add(image_name)
-
-            img = img.parent  # type: ignore
-
-        image_name = self._name_image(img, image_tag_map)
-        if isinstance(img, (BaseImage, SourceImage)):
-            remote_deps[image_name] = _title_image(img)
-        else:
-            local_deps.add(image_name)
-
-        return remote_deps, local_deps
-
     def render_build_ops(
         self,
         build_ops: List[BuildOperation],
@@ -495,7 +494,11 @@ class BuildExecutor:
                 continue
 
             lines = []
+            remote_deps: Dict[str, str] = {}
+            local_deps: Set[str] = set()
 
+            # Collect the Dockerfile lines and the build's dependencies in a
+            # single walk up the image chain.
             img = build_op.image
             while img is not build_op.root:
                 if isinstance(img, CommandImage):
@@ -505,25 +508,33 @@ class BuildExecutor:
                     if img.context is build_op.inline_context:
                         lines.append(f"COPY {img.command}")
                     else:
-                        lines.append(
-                            f"COPY --from={ self._name_image(img.context, image_tag_map) } {img.command}"
+                        context_name = self._name_dependency(
+                            img.context, image_tag_map, remote_deps, local_deps
                         )
+                        lines.append(f"COPY --from={ context_name } {img.command}")
                     img = img.parent
                 else:
                     raise AssertionError("Unexpected image type in build operation")
 
             build_empty = not lines
-            lines.append(f"FROM { self._name_image(img, image_tag_map) }")
+            from_name = self._name_dependency(
+                img, image_tag_map, remote_deps, local_deps
+            )
+            lines.append(f"FROM { from_name }")
             if syntax := self.tplbld.config.dockerfile_syntax:
                 lines.append(f"# syntax={syntax}")
 
+            # Lines were collected walking up from the final command.
+            lines.reverse()
             result.append(
                 RenderedBuildOperation(
-                    "\n".join(reversed(lines)),
+                    "\n".join(lines),
                     tags,
                     primary_tag,
                     build_title,
                     build_empty,
+                    remote_deps,
+                    local_deps,
                 )
             )
             if not build_empty:
@@ -553,6 +564,24 @@ class BuildExecutor:
             dependencies=local_deps,
         )
 
+    def _name_dependency(
+        self,
+        image: ImageDefinition,
+        image_tag_map: Dict[ImageDefinition, str],
+        remote_deps: Dict[str, str],
+        local_deps: Set[str],
+    ) -> str:
+        """
+        Construct the name of an image a build operation depends on and record
+        it in `remote_deps` if it is stored remotely or `local_deps` otherwise.
+        """
+        image_name = self._name_image(image, image_tag_map)
+        if isinstance(image, (BaseImage, SourceImage)):
+            remote_deps[image_name] = _title_image(image)
+        else:
+            local_deps.add(image_name)
+        return image_name
+
     def _name_image(
         self, image: ImageDefinition, image_tag_map: Dict[ImageDefinition, str]
     ) -> str:
@@ -568,7 +597,14 @@ class BuildExecutor:
             assert image.digest is not None
             return f"{image.repo}@{image.digest}"
         if isinstance(image, BaseImage):
-            return self.tplbld.get_base_image_name(image, use_digest=True)
+            # Base image names are rendered from the base_image_repo template;
+            # cache them since the same base is typically named by many builds.
+            key = (image, image.digest)
+            name = self._base_image_names.get(key)
+            if name is None:
+                name = self.tplbld.get_base_image_name(image, use_digest=True)
+                self._base_image_names[key] = name
+            return name
         if isinstance(image, ScratchImage):
             return "scratch"
         raise AssertionError("unexpected image type")
@@ -592,26 +628,28 @@ class BuildExecutor:
             async with self.tplbld.output_streamer.start_stream(title) as output_stream:
                 for attempt in range(self.build_retry + 1):
 
-                    def sync_write_context(pipe: SyncToAsyncPipe):
+                    def sync_write_context(write_fd: int):
                         assert context is not None
-                        context.write_context(
-                            pipe,  # type: ignore
-                            extra_files={"Dockerfile": (0o444, dockerfile_data)},
-                        )
-                        pipe.close()
-
-                    async def pipe_reader(pipe: SyncToAsyncPipe):
                         try:
-                            while data := await pipe.read():
-                                yield data
-                        finally:
-                            pipe.close()
+                            with open(write_fd, "wb") as fout:
+                                context.write_context(
+                                    fout,  # type: ignore
+                                    extra_files={
+                                        "Dockerfile": (0o444, dockerfile_data)
+                                    },
+                                )
+                        except BrokenPipeError:
+                            LOGGER.warning(
+                                "process exited before finished writing input"
+                            )
 
-                    pipe = SyncToAsyncPipe()
+                    # The context is written straight into a pipe that the
+                    # build client reads as its stdin.
+                    read_fd, write_fd = os.pipe()
                     try:
                         await asyncio.gather(
                             asyncio.get_running_loop().run_in_executor(
-                                None, sync_write_context, pipe
+                                None, sync_write_context, write_fd
                             ),
                             _create_subprocess(
                                 self.client_config.build,
@@ -622,7 +660,7 @@ class BuildExecutor:
                                     dependencies=dependencies or set(),
                                 ),
                                 output_stream=output_stream,
-                                input_data=pipe_reader(pipe),
+                                stdin_fd=read_fd,
                             ),
                         )
                         break
@@ -653,6 +691,23 @@ class BuildExecutor:
                 dict(image=image),
             )
 
+    async def untag_images(self, images: List[str]) -> None:
+        """
+        Untag each of the passed images. If the client has a bulk untag
+        command all images are untagged with a single command.
+        """
+        if not images:
+            return
+        if self.client_config.untag_bulk is None:
+            await asyncio.gather(*(self.untag_image(image) for image in images))
+            return
+        async with self.sem_tag_jobs:
+            await _create_subprocess(
+                self.client_config.untag_bulk,
+                self.tplbld.jinja_env,
+                dict(images=images),
+            )
+
     async def pull_image(self, image: str, title: str) -> None:
         """Wrapper that executes the client pull command"""
         assert self.client_config.pull is not None
@@ -708,6 +763,7 @@ class BuildExecutor:
             self.client_config.platform,
             self.tplbld.jinja_env,
             {},
+            capture_output=True,
         )
         try:
             return output.decode("utf-8").strip()
@@ -1,32 +1,40 @@
 import hashlib
 import json
+import threading
 
 # The default hashing algorithm used by tplbuild.
 HASHER = hashlib.sha256
 
+# Per-thread buffers that file contents are read into when hashing.
+_READ_BUFFERS = threading.local()
+_READ_BUFFER_SIZE = 2**20
 
-class HashWriter:
+
+def hash_file(fileobj) -> str:
     """
-    File-like writable object that passed all writes through to the supplied
-    hasher. It will automatically encode str data using the supplied encoding.
+    Generate a cryptographic hash of the contents of a binary file object
+    opened for reading. Returns the hex digest.
     """
+    if hasattr(hashlib, "file_digest"):
+        # Python 3.11+ reads into a single reused buffer rather than
+        # allocating a new bytes object for every chunk.
+        return hashlib.file_digest(fileobj, HASHER).hexdigest()
 
-    def __init__(self, hsh, *, encoding="utf-8") -> None:
-        self.hsh = hsh
-        self.encoding = encoding
+    buf = getattr(_READ_BUFFERS, "buf", None)
+    if buf is None:
+        buf = _READ_BUFFERS.buf = bytearray(_READ_BUFFER_SIZE)
+    view = memoryview(buf)
 
-    def write(self, data):
-        """Write data to the underlying hasher"""
-        if isinstance(data, bytes):
-            self.hsh.update(data)
-        else:
-            self.hsh.update(data.encode(self.encoding))
+    hsh = HASHER()
+    while size := fileobj.readinto(buf):
+        hsh.update(view[:size])
+    return hsh.hexdigest()
 
 
 def json_hash(data) -> str:
     """
     Generate a crytographic hash of JSON-able data. Returns the hex digest.
     """
-    hsh = HASHER()
-    json.dump(data, HashWriter(hsh), sort_keys=True)  # type: ignore
-    return hsh.hexdigest()
+    # Encode in one shot so json can use its C encoder and the hasher is fed
+    # a single buffer.
+    return HASHER(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
@@ -35,6 +35,16 @@ class OutputStream:
             stream.write(b"\n")
         stream.flush()
 
+    async def write_lines(self, lines: List[bytes], *, err: bool = False) -> None:
+        """
+        Write several lines of data, without their trailing newlines, to the
+        output stream with a single write and flush. Set err=True to write
+        to the error stream instead of output stream.
+        """
+        stream = sys.stderr.buffer if err else sys.stdout.buffer
+        stream.write(b"".join(self.prefix + line + b"\n" for line in lines))
+        stream.flush()
+
     async def end(self, success: bool) -> None:
         """
         End the output stream. If success is False buffered error content
@@ -595,7 +595,7 @@ class TplBuild:
                 functools.partial(
                     hash_graph,
                     (stage.image for stage in stages if stage.base_image),
-                    salt=self.build_data.hash_salt,
+                    salt=self.build_data.get_hash_salt(),
                     symbolic=False,
                 ),
             )
@@ -749,6 +749,8 @@ class TplBuild:
         """
         Save build data to disk.
         """
+        # Ensure the salt is persisted the first time build data is written.
+        self.build_data.get_hash_salt()
         try:
             with open_and_swap(
                 os.path.join(self.base_dir, ".tplbuilddata.json"),
@@ -1,9 +1,12 @@
 import contextlib
 import json
 import os
+import re
 import tempfile
 from typing import Any, Dict, Iterable, List, Sequence, Tuple
 
+_LINE_END_PATTERN = re.compile(r"\r\n?|\n")
+
 
 def line_reader(document: str) -> Iterable[Tuple[int, int, str]]:
     """
@@ -25,16 +28,9 @@ def line_reader(document: str) -> Iterable[Tuple[int, int, str]]:
     """
     lines = []
     line_start_idx = 0
-    line_last_ch = ""
-    for idx, ch in enumerate(document):
-        if ch == "\n":
-            end_idx = idx - 1 if line_last_ch == "\r" else idx
-            lines.append((line_start_idx, document[line_start_idx:end_idx]))
-            line_start_idx = idx + 1
-        elif line_last_ch == "\r":
-            lines.append((line_start_idx, document[line_start_idx : idx - 1]))
-            line_start_idx = idx
-        line_last_ch = ch
+    for match in _LINE_END_PATTERN.finditer(document):
+        lines.append((line_start_idx, document[line_start_idx : match.start()]))
+        line_start_idx = match.end()
     if line_start_idx < len(document):
         lines.append((line_start_idx, document[line_start_idx:]))
 